@@ -154,7 +154,7 @@ def _read_jsonld_file(jsonld_filepath, output_filepath, verbose, **kwargs):
     if not graph:
         raise Exception('Cannot parse graph from {}'.format(jsonld_filepath))
 
-    # Build new graph by remove the embedded line number from ontospy's graph
+    # Remove the embedded line numbers from ontospy's graph (in place)
     # and remember the line numbers in mapping {Node:line_number}
     graph, line_numbers_dict = precondition.postcondition(graph, json.loads(preconditioned_text)['@context'])
 
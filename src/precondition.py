@@ -16,12 +16,24 @@ by non-empty ones.
 (and remembers where they are) undoes the empty prefixes, and
 compensates for some of ontospy's deficiencies.
 '''
+import itertools
 import re
 import string
 import rdflib
 
 DEFAULT_PREFIX_LENGTH = 3
 DEFAULT_ALPHABET = string.ascii_lowercase
+PREFIX_PROBE_COUNT = 16    # prefix strings to probe before searching the text for all prefix strings
+
+# Regular expressions used by the preconditioning helpers, compiled once per process
+# (_EMPTY_PREFIX_IRI_RE is ":([\w-]+)" with the [\w-]+ run made atomic by capturing it
+# in a lookahead, so a run not followed by a double-quote fails without backtracking)
+_EMPTY_PREFIX_IRI_RE = re.compile(r'":(?=([\w-]+))\1"')                # [\w] is [A-Za-z0-9_]
+_TYPE_RE = re.compile(r'( *"@type": *")([\w:#/-]+)(",)')               # a @type declaration
+
+# The iri starts that can follow "":<s> in the empty-string @context
+# (https first: it is the most common, e.g., https://unifiedcyberontology.org/...)
+_CONTEXT_IRI_STARTS = ('"https://', '"http://', '"file://')
 
 def precondition(text, prefix=None):
     '''
@@ -59,53 +71,103 @@ def postcondition(graph, context):
         context {prefix:expanded_location}
         graph   A rdflib_graph object
 
-    Return: tuple (new_graph, {node:line_number})
-        new_graph   A rdflib_graph object with embedded line numbers removed
+    Return: tuple (graph, {node:line_number})
+        graph       The same rdflib_graph object, modified in place with embedded line numbers removed
         node        An rdflib.term.URIRef or rdflib.term.BNode
         line_number The extracted line number for this node
     '''
-    # Start with empty dictionary and empty new graph
-    line_numbers = {}
-    new_graph = rdflib.Graph()
-
-    # Do for each triple in the original graph
-    for subject, predicate, obj in graph.triples((None, None, None)):
-
-        # If obj is a literal and its datatype has a line number
-        # remove line number from datatype (do NOT replaces its prefix)
-        if isinstance(obj, rdflib.term.Literal) and obj.datatype:
-            stripped_string, number = extract_line_number(obj.datatype)
-            if number:
-                obj = rdflib.term.Literal(str(obj), datatype=stripped_string)
-                line_numbers[subject] = number
-
-        # If obj is a literal and has no datatype, it's one of those ambiguous cases
-        # If it has an IRI prefix in the context, expand its prefix and replace with a URIRef
-        if isinstance(obj, rdflib.term.Literal) and not obj.datatype:
-            value = str(obj)
-            parts = value.split(':', 1)    # does value look like prefix:stuff?
-            if len(parts) > 1 and parts[0] in context:    # yes, and the prefix is in the context!
-                parts[0] = context[parts[0]]
-                obj = rdflib.term.URIRef(parts[0] + parts[1])
-
-        # If obj is a URIRef (maybe just created above!) and has a line number,
-        # remove line number from URIRef object
-        if isinstance(obj, rdflib.term.URIRef):
-            stripped_string, number = extract_line_number(str(obj))
-            if number:
-                obj = rdflib.term.URIRef(stripped_string)
-                line_numbers[subject] = number
+    # Find the triples to replace and the line numbers
+    replacements, line_numbers = _rewrite_triples(graph.triples((None, None, None)), context)
 
-        # If obj is a BNode, leave it alone
+    # Replace modified triples in place (unmodified triples, usually most of them, are left alone)
+    for old_triple, _ in replacements:
+        graph.remove(old_triple)
+    graph.addN((subject, predicate, obj, graph) for _, (subject, predicate, obj) in replacements)
 
-        # Add to new_graph
-        new_graph.add((subject, predicate, obj))
-
-    return new_graph, line_numbers
+    # Build {node:line_number} from the pairs in one step (a later pair for a node wins)
+    return graph, dict(line_numbers)
 
 
 # ================================== HELPER FUNCTIONS =================================================
 
+def _rewrite_triples(triples, context):
+    '''
+    Arguments:
+        triples  An iterable of (subject, predicate, obj) triples from the graph
+        context  {prefix:expanded_location}
+
+    Return: Tuple of:
+        replacements    List of (old_triple, new_triple) for the triples that must be replaced
+        line_numbers    List of (node, line_number) pairs, in the order found
+    '''
+    # Start with empty lists of (node, line_number) pairs and (old_triple, new_triple) replacements
+    line_numbers = []
+    replacements = []
+
+    # Bind names used for every triple to locals (faster lookup in the loop below)
+    Literal = rdflib.term.Literal
+    URIRef = rdflib.term.URIRef
+    extract = extract_line_number
+    append = replacements.append
+    append_line_number = line_numbers.append
+
+    # The strings that start a value that looks like prefix:stuff, where prefix is in the context
+    # (only for a {prefix:expanded_location} context; a json-ld @context can also be a list,
+    # and a term can map to an expanded definition {"@id":..., ...} rather than a string)
+    if isinstance(context, dict):
+        context_prefixes = tuple(
+            prefix + ':' for prefix, location in context.items()
+            if ':' not in prefix and isinstance(location, str))
+    else:
+        context_prefixes = ()
+
+    # Do for each triple
+    for subject, predicate, obj in triples:
+        original_obj = obj
+        kind = type(obj)    # dispatch on the exact type, one test per triple
+
+        # If obj is a URIRef and has a line number, remove line number from URIRef object
+        # (most do not, so check for _LINE_ before calling extract_line_number())
+        if kind is URIRef:
+            if '_LINE_' in obj:
+                stripped_string, number = extract(obj)
+                if number:
+                    obj = URIRef(stripped_string)
+                    append_line_number((subject, number))
+
+        elif kind is Literal:
+
+            # If obj is a literal and its datatype has a line number
+            # remove line number from datatype (do NOT replaces its prefix)
+            datatype = obj.datatype
+            if datatype:
+                if '_LINE_' in datatype:
+                    stripped_string, number = extract(datatype)
+                    if number:
+                        obj = Literal(str(obj), datatype=stripped_string)
+                        append_line_number((subject, number))
+
+            # If obj is a literal and has no datatype, it's one of those ambiguous cases
+            # If it has an IRI prefix in the context, expand its prefix and replace with a URIRef
+            # (with its line number, if any, removed as for any URIRef)
+            # Literal is a str, so use it directly (but rdflib overrides startswith() with a
+            # version that copies the string and does not accept a tuple, so use str's)
+            elif str.startswith(obj, context_prefixes):    # does obj look like prefix:stuff, prefix in the context?
+                index = obj.index(':')
+                stripped_string, number = extract(context[obj[:index]] + obj[index+1:])
+                obj = URIRef(stripped_string)
+                if number:
+                    append_line_number((subject, number))
+
+        # If obj is a BNode, leave it alone
+
+        # If obj was modified, remember to replace the triple
+        if obj is not original_obj:
+            append(((subject, predicate, original_obj), (subject, predicate, obj)))
+
+    return replacements, line_numbers
+
+
 def extract_line_number(text):
     '''
     Arguments:
@@ -115,11 +177,11 @@ def extract_line_number(text):
         stripped_text   String with _LINE_n removed if it was present
         number          Line number if _LINE_n was present, else None
     '''
-    parts = text.rsplit('_LINE_')
-    if len(parts) == 1:
+    index = text.rfind('_LINE_')
+    if index < 0:
         return text, None
     else:
-        return parts[0], int(parts[1])
+        return text[:index], int(text[index+6:])    # 6 is len('_LINE_')
 
 
 def autogenerate_empty_prefix(text, prefix_length, alphabet):
@@ -130,9 +192,25 @@ def autogenerate_empty_prefix(text, prefix_length, alphabet):
     Return:
         An empty_prefix not found anywhere in the text
     '''
-    # Find strings in the text that could be prefix strings
-    match_string = r'(\w{%s}):' % prefix_length    # e.g., '(\w{3}):'
-    non_candidate_prefix_strings = set(re.findall(match_string, text))
+    # Probe the first few prefix strings directly; a prefix string is in use iff it is followed by
+    # a colon somewhere in the text, and usually one of the first few is not, so this avoids the
+    # search of the whole text for strings that could be prefix strings
+    probes = itertools.islice(_prefix_iter(prefix_length, alphabet), PREFIX_PROBE_COUNT)
+    for prefix in probes:
+        if prefix + ':' not in text:
+            return prefix
+
+    # Find strings in the text that could be prefix strings: the prefix_length characters
+    # before each colon, if they are all word characters (what \w matches, i.e., the
+    # alphanumeric characters and '_')
+    non_candidate_prefix_strings = set()
+    add = non_candidate_prefix_strings.add
+    position = text.find(':', prefix_length)
+    while position >= 0:
+        tail = text[position-prefix_length:position]
+        if tail.replace('_', '0').isalnum():
+            add(tail)
+        position = text.find(':', position + 1)
 
     # If we found all possible strings (this is really unlikely),
     # we probably need to increase the string length
@@ -140,7 +218,7 @@ def autogenerate_empty_prefix(text, prefix_length, alphabet):
         raise Exception('Could not find unused prefix sequence!')
 
     # Look for a prefix string that is not is the non_candidate set
-    for prefix in PrefixGenerator(prefix_length, alphabet):
+    for prefix in _prefix_iter(prefix_length, alphabet):
         if prefix not in non_candidate_prefix_strings:
             return prefix
 
@@ -177,23 +255,28 @@ def replace_empty_prefix(text, empty_prefix):
 
         If we find that violates these assumptions, we will have to refine this approach.
     '''
-    # 1. Look for the empty-string @context and substitute the replacement prefix
+    # 1. Look for the empty-string @context (each "": followed by <s>"<h>://,
+    #    where <s> is any whitespace) and substitute the replacement prefix
     #    If not found, return the original text unchanged
     #    If more than one found, we've got a problem
-    pattern = r'"":(\s*"(?:http|https|file)://)'
-    text, count = re.subn(
-        pattern,
-        lambda m: '"{}":{}'.format(empty_prefix, m.group(1)),
-        text)
-    if not count:   # If count is zero, no occurrences were found
+    length = len(text)
+    context_start = None
+    start = text.find('"":')
+    while start >= 0:
+        position = start + 3
+        while position < length and text[position].isspace():
+            position += 1
+        if text.startswith(_CONTEXT_IRI_STARTS, position):
+            if context_start is not None:   # This simple approach cannot handle mulitple occurrences
+                raise Exception('Found multiple tokens that look like empty-string contexts')
+            context_start = start
+        start = text.find('"":', position)
+    if context_start is None:   # No occurrences were found
         return text
-    if count > 1:   # This simple approach cannot handle mulitple occurrences
-        raise Exception('Found multiple tokens that look like empty-string contexts')
+    text = text[:context_start+1] + empty_prefix + text[context_start+1:]
 
     # 2. Look for apparent empty-prefixed iri
-    pattern = r'":([\w-]+)"'     # [\w] is [A-Za-z0-9_]
-    text, count = re.subn(
-        pattern,
+    text, count = _EMPTY_PREFIX_IRI_RE.subn(
         lambda m: '"{}:{}"'.format(empty_prefix, m.group(1)),
         text)
 
@@ -211,62 +294,60 @@ def embed_line_numbers(text):
            with "_LINE_n" appended to all @type values,
            where n is the (possibly multidigit) line number
     '''
-    # This regular expressions matches a @type declaration in the json-ld file
-    type_matcher = re.compile(r'( *"@type": *")([\w:#/-]+)(",)')
-
-    # Do for each line in text
-    lines = text.split('\n')
-    for line_number, line in enumerate(lines):
+    # Only lines containing "@type": can be @type statements, so find those
+    # instead of splitting the text into lines, and copy the text between them unchanged
+    pieces = []
+    position = 0        # start of the text not yet copied to pieces
+    line_number = 1     # line number (1-based) at counted
+    counted = 0         # position up to which '\n's have been counted
+    hit = text.find('"@type":')
+    while hit >= 0:
+        line_start = text.rfind('\n', 0, hit) + 1
+        line_end = text.find('\n', hit)
+        if line_end < 0:
+            line_end = len(text)
 
         # If the line is a @type statement...
-        matches = type_matcher.match(line)
+        # (it is only if the hit is preceded by nothing but spaces, e.g., not by a key as in
+        # "key": {"@type": ..., so check that cheaply before matching the regular expression)
+        if text.count(' ', line_start, hit) != hit - line_start:
+            matches = None
+        else:
+            matches = _TYPE_RE.match(text, line_start)
         if matches:
+            line_number += text.count('\n', counted, line_start)
+            counted = line_start
 
             # Replace that line with a new line with _LINE_n appended to the type
-            lines[line_number] = '{}{}_LINE_{}{}'.format(
-                matches.group(1),
-                matches.group(2),
-                line_number+1,    # enumerate() returns 0-based line_number, we want 1-based
-                matches.group(3))
+            # (as before, anything on the line after the type's closing '",' is dropped)
+            pieces.append(text[position:matches.end(2)])
+            pieces.append('_LINE_{}{}'.format(line_number, matches.group(3)))
+            position = line_end
 
-    # Reconstruct and return the '\n'-separated text with modified @types
-    return '\n'.join(lines)
+        # Go on to the next line containing "@type":
+        hit = text.find('"@type":', line_end)
 
+    # Reconstruct and return the '\n'-separated text with modified @types
+    pieces.append(text[position:])
+    return ''.join(pieces)
 
 
-class PrefixGenerator:
+def _prefix_iter(prefix_length, alphabet):
     '''
     Prefix string generator.
 
+    Arguments:
+        prefix_length   The number of characters in the prefix (please keep this small)
+        alphabet        A string of the characters that can appear in the prefix
+
+    Return:
+        An iterator over all the prefix strings, in order
+
     Usage:
-        for string in PrefixGenerator():   # assuming default parameters (see __init__())
+        for string in _prefix_iter(DEFAULT_PREFIX_LENGTH, DEFAULT_ALPHABET):
             process(string)
     '''
-    def __init__(self, prefix_length, alphabet):
-        '''
-        Create and initialize the prefix string generator
-
-        Arguments:
-            prefix_length   The number of characters in the prefix (please keep this small)
-            alphabet        A string of the characters that can appear in the prefix
-        '''
-        self.prefix_length = prefix_length
-        self.alphabet = alphabet
-        self.alphabet_length = len(alphabet)
-        self.max_count = self.alphabet_length**prefix_length
-
-    def __iter__(self):
-        '''
-        The generator that yields successive strings
-        '''
-        for count in range(self.max_count):
-            digits = [0]*self.prefix_length
-            position = self.prefix_length
-            while count:
-                position -= 1
-                digits[position] = count % self.alphabet_length
-                count //= self.alphabet_length
-            yield ''.join(self.alphabet[c] for c in digits)
+    return (''.join(characters) for characters in itertools.product(alphabet, repeat=prefix_length))
 
 
 
@@ -314,17 +395,21 @@ if __name__ == '__main__':
         # Parse command line
         args = parser.parse_args(sys.argv[1:])
 
-        # Read the input file
-        text = open(args.jsonld_filepath).read()
+        # Read the input file as bytes and decode it once
+        # (translating '\r\n' and '\r' line endings to '\n', as reading in text mode does)
+        with open(args.jsonld_filepath, 'rb') as infile:
+            text = infile.read().decode('utf-8')
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
 
         # Precondition
         text = precondition(text, args.prefix)
 
-        # Write results
+        # Write results as utf-8 bytes, unchanged (followed by '\n', as print() would)
         if args.output_filepath is None:
-            print(text)
+            sys.stdout.buffer.write(text.encode('utf-8') + b'\n')
         else:
-            with open(args.output_filepath, 'w') as outfile:
-                print(text, file=outfile)
+            with open(args.output_filepath, 'wb') as outfile:
+                outfile.write(text.encode('utf-8') + b'\n')
 
     main()